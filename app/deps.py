@@ -1,10 +1,17 @@
 import os
 import joblib
 import logging
-from typing import Optional
+from joblib import parallel_config
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+class MissingFeaturesError(ValueError):
+    """Raised when a request omits features the model was trained on"""
+
+
 # Global model variable
 model: Optional[object] = None
 
@@ -17,12 +24,183 @@ def load_model():
     try:
         model = joblib.load(model_path)
         logger.info(f"Model loaded successfully from {model_path}")
+        _cache_pipeline_steps(model)
+        _attach_explainer(model)
+        _attach_compiled_scorer(model, model_path)
         return model
     except Exception as e:
         logger.error(f"Failed to load model from {model_path}: {e}")
         raise
 
 
+def _cache_pipeline_steps(model):
+    """Cache the fitted column order and pipeline steps on the model"""
+    feature_names = getattr(model, 'feature_names_in_', None)
+    if feature_names is not None:
+        model._feature_order = pd.Index(feature_names)
+        model._feature_set = frozenset(feature_names)
+    
+    named_steps = getattr(model, 'named_steps', None)
+    if named_steps and 'preprocess' in named_steps and 'clf' in named_steps:
+        preprocess = named_steps['preprocess']
+        model._preprocess = preprocess
+        model._clf = named_steps['clf']
+        model._feature_names = [name.split('__', 1)[-1] for name in preprocess.get_feature_names_out()]
+        
+        # Trained with n_jobs=-1; score single rows serially and let
+        # predict_risk() opt batches into parallel tree evaluation
+        if hasattr(model._clf, 'n_jobs'):
+            model._clf.n_jobs = None
+
+
+def features_to_frame(model, features: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Build a single-row feature frame in the model's fitted column order.
+    
+    The preprocess step selects columns by name, so a frame is still needed,
+    but building it from one object row skips pandas' per-key dict alignment
+    and dtype inference.
+    """
+    return batch_features_to_frame(model, [features])
+
+
+def batch_features_to_frame(model, batch: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build an (N, p) feature frame in the model's fitted column order.
+    Raises MissingFeaturesError for absent features; null values become NaN
+    so the pipeline's imputers fill them in.
+    """
+    feature_order = getattr(model, '_feature_order', None)
+    if feature_order is None:
+        return pd.DataFrame(batch)
+    
+    required = model._feature_set
+    rows = []
+    for i, features in enumerate(batch):
+        if not features.keys() >= required:
+            missing = sorted(required.difference(features))
+            where = f" for patient {i}" if len(batch) > 1 else ""
+            raise MissingFeaturesError(f"Missing features{where}: {', '.join(missing)}")
+        
+        row = [features[name] for name in feature_order]
+        if None in row:
+            row = [np.nan if value is None else value for value in row]
+        rows.append(row)
+    
+    return pd.DataFrame(np.array(rows, dtype=object), columns=feature_order)
+
+
+def _attach_explainer(model):
+    """
+    Build the SHAP explainer once and cache it on the model.
+    The model is immutable after loading, so every request can reuse it.
+    """
+    if getattr(model, '_preprocess', None) is None:
+        return
+    
+    try:
+        import shap
+        
+        model._explainer = shap.TreeExplainer(model.named_steps['clf'])
+        logger.info("SHAP explainer cached on model")
+    except ImportError:
+        logger.warning("SHAP not available, explanations will use fallback")
+    except Exception as e:
+        logger.warning(f"Failed to build SHAP explainer: {e}")
+
+
+def _attach_compiled_scorer(model, model_path: str):
+    """
+    Load the ONNX export of the classifier, if present, and cache an
+    ONNX Runtime session on the model. The sklearn pipeline is then only
+    used for the preprocess step.
+    """
+    onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+    if not os.path.exists(onnx_path) or getattr(model, '_preprocess', None) is None:
+        return
+    
+    if os.path.getmtime(onnx_path) < os.path.getmtime(model_path):
+        logger.warning(f"Ignoring stale ONNX export {onnx_path}, re-run training to refresh it")
+        return
+    
+    try:
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        
+        model._onnx_session = session
+        model._onnx_input = session.get_inputs()[0].name
+        
+        # Forest probabilities are averages of per-tree votes, i.e. mostly k/n_trees
+        estimators = getattr(model._clf, 'estimators_', None)
+        model._onnx_vote_grid = len(estimators) if estimators is not None else None
+        logger.info(f"ONNX scorer loaded from {onnx_path}")
+    except ImportError:
+        logger.warning("onnxruntime not available, scoring with scikit-learn")
+    except Exception as e:
+        logger.warning(f"Failed to load ONNX scorer from {onnx_path}: {e}")
+
+
+def prepare_features(model, features_df: pd.DataFrame):
+    """
+    Run the preprocess step once so prediction and SHAP can share its output.
+    
+    Returns a dense, C-contiguous float32 matrix (the dtype the tree models and
+    the ONNX scorer use internally), or the frame unchanged for models without
+    cached pipeline steps.
+    """
+    preprocess = getattr(model, '_preprocess', None)
+    if preprocess is None:
+        return features_df
+    
+    X = preprocess.transform(features_df)
+    if hasattr(X, 'toarray'):
+        X = X.toarray()
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+
+def predict_risk(model, X) -> np.ndarray:
+    """
+    Return the positive-class probability for each row of prepare_features() output.
+    Uses the compiled ONNX scorer when available, otherwise the sklearn classifier.
+    """
+    session = getattr(model, '_onnx_session', None)
+    if session is not None:
+        probabilities = session.run(['probabilities'], {model._onnx_input: X})[0]
+        return _snap_to_vote_grid(probabilities[:, 1].astype(np.float64), getattr(model, '_onnx_vote_grid', None))
+    
+    # Skip the pipeline's step dispatch when X is already preprocessed
+    estimator = getattr(model, '_clf', None)
+    if estimator is None:
+        estimator = model
+    if len(X) == 1:
+        return estimator.predict_proba(X)[:, 1]
+    
+    # Spread trees across cores for batches; not worth the dispatch cost for one row
+    with parallel_config(backend='threading', n_jobs=-1):
+        return estimator.predict_proba(X)[:, 1]
+
+
+def _snap_to_vote_grid(risk: np.ndarray, n_trees: Optional[int]) -> np.ndarray:
+    """
+    Undo ONNX Runtime's float32 rounding for forest probabilities.
+    
+    A vote of exactly k/n_trees (e.g. 0.80) comes back as 0.7999994 in float32,
+    which would flip a score sitting on the alert threshold. Values within
+    float32 noise of the k/n_trees grid are snapped back onto it; anything else
+    (e.g. averages of impure leaves) is left as is.
+    """
+    if not n_trees:
+        return risk
+    votes = risk * n_trees
+    snapped = np.round(votes)
+    return np.where(np.abs(votes - snapped) < 1e-3, snapped / n_trees, risk)
+
+
 def get_model():
     """Get the loaded model"""
     global model
@@ -1,37 +1,59 @@
 import os
+import time
 import uuid
+import asyncio
+import itertools
 import logging
+import secrets
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set
 from contextlib import asynccontextmanager
-import pandas as pd
-from fastapi import FastAPI, HTTPException, Request
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
 
+# Variables set by the deployment win over .env, both here and in /reload-config
+PROCESS_ENV_KEYS = frozenset(os.environ)
+
+# Load environment variables before modules that read config at import
+load_dotenv()
+
+from . import rules
 from .schemas import ScoreRequest, ScoreResponse, Factor, AlertData
-from .deps import load_model, get_model
+from .deps import MissingFeaturesError, load_model, get_model, features_to_frame, batch_features_to_frame, prepare_features, predict_risk
 from .rules import should_alert
 from .storage import storage
 from .notifier import notifier
-from .shap_explain import safe_explain_top_k
-
-# Load environment variables
-load_dotenv()
+from .shap_explain import safe_explain_top_k, safe_explain_top_k_batch
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Log one in every N non-alerting scores; alerts are always logged
+SCORE_LOG_SAMPLE_RATE = max(1, int(os.getenv('SCORE_LOG_SAMPLE_RATE', '100')))
+score_log_counter = itertools.count()
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+background_tasks: Set[asyncio.Task] = set()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load model on startup"""
     try:
         load_model()
+        _warm_templates()
+        await storage.connect()
         logger.info("Application startup complete")
         yield
+        # Let in-flight voice notifications finish before closing connections
+        if background_tasks:
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await notifier.close()
+        await storage.close()
     except Exception as e:
         logger.error(f"Startup failed: {e}")
         raise
@@ -45,60 +67,68 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# Initialize Jinja2 templates
+# Initialize Jinja2 templates; they never change at runtime, so skip reload checks
 templates = Jinja2Templates(directory="app/templates")
+templates.env.auto_reload = False
+
+# Compiled templates, filled at startup by _warm_templates()
+template_cache: Dict[str, Any] = {}
+
+
+def _warm_templates():
+    """Compile the HTML templates once so the first request doesn't pay for it"""
+    for name in ("case.html", "dashboard.html"):
+        template_cache[name] = templates.get_template(name)
+
+
+def _render_template(name: str, context: Dict[str, Any]) -> HTMLResponse:
+    """Render a pre-compiled template straight into an HTMLResponse"""
+    template = template_cache.get(name)
+    if template is None:
+        template = template_cache[name] = templates.get_template(name)
+    return HTMLResponse(template.render(**context))
 
 
 @app.post("/score", response_model=ScoreResponse)
-async def score_patient(request: ScoreRequest):
+async def score_patient(request: ScoreRequest, explain: bool = False):
     """
     Score a patient for cardiac risk and potentially trigger alerts.
+    
+    SHAP explanations are only computed when an alert fires, or when
+    `?explain=true` is passed; otherwise `top_factors` is empty.
     """
     try:
         # Get the loaded model
         model = get_model()
         
-        # Convert features to DataFrame for prediction
-        features_df = pd.DataFrame([request.features])
+        # Convert features to a single row in the model's column order,
+        # preprocessed once for both prediction and explanation
+        features_df = features_to_frame(model, request.features)
+        X = prepare_features(model, features_df)
         
         # Get prediction probability
-        risk_prob = model.predict_proba(features_df)[0][1]  # Probability of positive class
-        
-        # Get SHAP explanations (safe fallback)
-        top_factors = safe_explain_top_k(model, request.features, k=3)
-        
-        # Convert to Factor objects
-        factors = [Factor(feature=f['feature'], impact=f['impact']) for f in top_factors]
+        risk_prob = float(predict_risk(model, X)[0])  # Probability of positive class
         
         # Check if alert should be triggered
-        alerted = should_alert(risk_prob, request.patient_ref_token)
+        alerted = await should_alert(risk_prob, request.patient_ref_token)
         alert_id = None
         
+        # Get SHAP explanations (safe fallback) only when they will be used
+        factors = []
+        if alerted or explain:
+            top_factors = safe_explain_top_k(model, request.features, k=3, X=X)
+            factors = [Factor.model_construct(feature=f['feature'], impact=f['impact']) for f in top_factors]
+        
         if alerted:
-            # Generate alert ID
-            alert_id = f"alrt_{uuid.uuid4().hex[:8]}"
-            
-            # Create alert data
-            alert_data = AlertData(
-                alert_id=alert_id,
-                patient_token=request.patient_ref_token,
-                risk=risk_prob,
-                top_factors=factors,
-                timestamp=datetime.now().isoformat()
-            )
+            alert_data = _build_alert(request.patient_ref_token, risk_prob, factors)
+            alert_id = alert_data.alert_id
             
-            # Save alert
-            storage.save_alert(alert_data)
+            # Save alert; the voice notification continues after we respond
+            await _dispatch_alert(alert_data)
             
-            # Set cooldown
-            storage.set_cooldown(request.patient_ref_token)
-            
-            # Send voice notification
-            notifier.notify_voice(alert_data)
-            
-            logger.info(f"Alert triggered for patient {request.patient_ref_token}, risk: {risk_prob:.3f}")
-        else:
-            logger.info(f"No alert for patient {request.patient_ref_token}, risk: {risk_prob:.3f}")
+            logger.info("Alert triggered for patient %s, risk: %.3f", request.patient_ref_token, risk_prob)
+        elif next(score_log_counter) % SCORE_LOG_SAMPLE_RATE == 0:
+            logger.info("No alert for patient %s, risk: %.3f", request.patient_ref_token, risk_prob)
         
         return ScoreResponse(
             risk=risk_prob,
@@ -107,11 +137,109 @@ async def score_patient(request: ScoreRequest):
             alert_id=alert_id
         )
         
+    except MissingFeaturesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Scoring failed: {e}")
         raise HTTPException(status_code=500, detail=f"Scoring failed: {str(e)}")
 
 
+@app.post("/score_batch", response_model=List[ScoreResponse])
+async def score_patients(requests: List[ScoreRequest], explain: bool = False):
+    """
+    Score a batch of patients with one model call and one SHAP call.
+    
+    As with /score, only alerting patients are explained unless
+    `?explain=true` is passed.
+    """
+    if not requests:
+        return []
+    
+    try:
+        model = get_model()
+        
+        # Stack all feature rows into a single (N, p) frame and preprocess it once
+        batch = [request.features for request in requests]
+        features_df = batch_features_to_frame(model, batch)
+        X = prepare_features(model, features_df)
+        
+        # One prediction call for the whole batch
+        risk_probs = [float(risk_prob) for risk_prob in predict_risk(model, X)]
+        
+        # Claim cooldowns concurrently; each claim is atomic, so repeated tokens in one batch still alert once
+        alerted_flags = await asyncio.gather(*(
+            should_alert(risk_prob, request.patient_ref_token)
+            for request, risk_prob in zip(requests, risk_probs)
+        ))
+        
+        # One explanation call covering only the rows that need it
+        explain_rows = [i for i, alerted in enumerate(alerted_flags) if alerted or explain]
+        batch_factors = [[] for _ in requests]
+        if explain_rows:
+            X_explain = X[explain_rows] if isinstance(X, np.ndarray) else None
+            explained = safe_explain_top_k_batch(model, [batch[i] for i in explain_rows], k=3, X=X_explain)
+            for i, top_factors in zip(explain_rows, explained):
+                batch_factors[i] = [Factor.model_construct(feature=f['feature'], impact=f['impact']) for f in top_factors]
+        
+        responses = []
+        pending_alerts = []
+        for request, risk_prob, alerted, factors in zip(requests, risk_probs, alerted_flags, batch_factors):
+            alert_id = None
+            
+            if alerted:
+                alert_data = _build_alert(request.patient_ref_token, risk_prob, factors)
+                alert_id = alert_data.alert_id
+                pending_alerts.append(alert_data)
+            
+            responses.append(ScoreResponse(
+                risk=risk_prob,
+                top_factors=factors,
+                alerted=alerted,
+                alert_id=alert_id
+            ))
+        
+        # Fan out alert side effects (storage, voice) concurrently
+        if pending_alerts:
+            await asyncio.gather(*(_dispatch_alert(alert_data) for alert_data in pending_alerts))
+        
+        logger.info(f"Scored batch of {len(requests)} patients, {len(pending_alerts)} alerts triggered")
+        return responses
+        
+    except MissingFeaturesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch scoring failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch scoring failed: {str(e)}")
+
+
+def _build_alert(patient_token: str, risk: float, factors: List[Factor]) -> AlertData:
+    """Create alert data with a fresh alert ID (trusted values, so validation is skipped)"""
+    return AlertData.model_construct(
+        alert_id=f"alrt_{uuid.uuid4().hex[:8]}",
+        patient_token=patient_token,
+        risk=risk,
+        top_factors=factors,
+        timestamp=time.time()
+    )
+
+
+async def _dispatch_alert(alert_data: AlertData):
+    """
+    Persist an alert and start its voice notification in the background.
+    The save is awaited so /case can serve the returned alert ID right away.
+    """
+    await storage.save_alert(alert_data)
+    _run_in_background(notifier.notify_voice(alert_data))
+
+
+def _run_in_background(coro):
+    """Schedule a coroutine without awaiting it, keeping a reference until done"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
 @app.get("/case/{token}", response_class=HTMLResponse)
 async def view_case(request: Request, token: str):
     """
@@ -119,7 +247,7 @@ async def view_case(request: Request, token: str):
     """
     try:
         # Get alert data
-        alert = storage.get_alert(token)
+        alert = await storage.get_alert(token)
         
         if not alert:
             raise HTTPException(status_code=404, detail="Case not found")
@@ -130,12 +258,12 @@ async def view_case(request: Request, token: str):
             "token": token,
             "risk": alert.risk,
             "top_factors": alert.top_factors,
-            "timestamp": alert.timestamp,
+            "timestamp": datetime.fromtimestamp(alert.timestamp).isoformat(timespec='seconds'),
             "alerted": True,
             "alert_id": alert.alert_id
         }
         
-        return templates.TemplateResponse("case.html", context)
+        return _render_template("case.html", context)
         
     except HTTPException:
         raise
@@ -150,10 +278,44 @@ async def health_check():
     return {"status": "healthy", "model_loaded": get_model() is not None}
 
 
+def _reload_dotenv():
+    """Re-apply .env with the same precedence as startup: deployment variables are never overridden"""
+    for key, value in dotenv_values().items():
+        if key not in PROCESS_ENV_KEYS and value is not None:
+            os.environ[key] = value
+
+
+@app.post("/reload-config")
+async def reload_config(x_reload_token: Optional[str] = Header(None)):
+    """
+    Re-read alert threshold and cooldown settings from the environment.
+    
+    Only the worker process serving this request is updated, so this is
+    meant for single-worker deployments; the worker's PID is returned.
+    
+    Disabled unless CONFIG_RELOAD_TOKEN is set; callers must send it in
+    the X-Reload-Token header.
+    """
+    expected_token = os.getenv('CONFIG_RELOAD_TOKEN')
+    if not expected_token:
+        raise HTTPException(status_code=403, detail="Config reload disabled, set CONFIG_RELOAD_TOKEN to enable it")
+    if not x_reload_token or not secrets.compare_digest(x_reload_token, expected_token):
+        raise HTTPException(status_code=401, detail="Invalid reload token")
+    
+    _reload_dotenv()
+    rules.reload_config()
+    storage.reload_config()
+    return {
+        "risk_threshold": rules.RISK_THRESHOLD,
+        "cooldown_minutes": storage.cooldown_seconds // 60,
+        "pid": os.getpid()
+    }
+
+
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request):
     """Main dashboard interface"""
-    return templates.TemplateResponse("dashboard.html", {"request": request})
+    return _render_template("dashboard.html", {"request": request})
 
 
 @app.get("/api")
@@ -164,8 +326,10 @@ async def api_info():
         "version": "1.0.0",
         "endpoints": {
             "POST /score": "Score patient for cardiac risk",
+            "POST /score_batch": "Score a batch of patients for cardiac risk",
             "GET /case/{token}": "View case details",
             "GET /health": "Health check",
+            "POST /reload-config": "Reload alert threshold and cooldown settings (requires X-Reload-Token)",
             "GET /api": "This information"
         }
     }
@@ -1,11 +1,32 @@
 import os
-import socket
+import asyncio
 import logging
-from typing import Optional
+from typing import Dict, Optional
 from .schemas import AlertData
 
 logger = logging.getLogger(__name__)
 
+# Reconnect with exponential backoff: 0.5s, 1s, 2s, ... capped at 5s
+RECONNECT_ATTEMPTS = 3
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 5.0
+AMI_TIMEOUT = 10
+
+# TTS message (PHI-free) and AMI frame templates, parsed once at import
+ALERT_MESSAGE = "High-risk cardiac score for case {short_id}. Check your secure portal.".format
+ORIGINATE_FRAME = (
+    "Action: Originate\r\n"
+    "Channel: SIP/{number}\r\n"
+    "Application: Playback\r\n"
+    "Data: {message}\r\n"
+    "Async: true\r\n"
+    "ActionID: {action_id}\r\n\r\n"
+).format
+
+
+class ActionNotSentError(ConnectionError):
+    """Raised when an AMI action could not be written, so Asterisk never received it"""
+
 
 class VoIPNotifier:
     def __init__(self):
@@ -25,95 +46,207 @@ class VoIPNotifier:
         
         if not self.ami_available:
             logger.warning("Asterisk AMI configuration incomplete, voice alerts will be simulated")
+        
+        # Persistent AMI connection state
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._connect_lock = asyncio.Lock()
+        
+        # The login frame never changes, so build it once per notifier
+        self._login_frame = (
+            f"Action: Login\r\n"
+            f"Username: {self.asterisk_user}\r\n"
+            f"Secret: {self.asterisk_pass}\r\n"
+            f"Events: off\r\n\r\n"
+        ).encode()
 
-    def notify_voice(self, alert: AlertData) -> bool:
+    async def connect(self):
+        """
+        Open the AMI connection and log in once.
+        Responses are then read by a background task and routed by ActionID.
+        """
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.asterisk_host, self.asterisk_port),
+            timeout=AMI_TIMEOUT
+        )
+        
+        try:
+            # Read initial banner
+            banner = await asyncio.wait_for(reader.readline(), timeout=AMI_TIMEOUT)
+            if not banner.startswith(b'Asterisk'):
+                raise Exception("Invalid AMI response")
+            
+            # Login to AMI
+            writer.write(self._login_frame)
+            await writer.drain()
+            
+            frame = await asyncio.wait_for(self._read_ami_frame(reader), timeout=AMI_TIMEOUT)
+            response = self._parse_ami_frame(frame)
+            if response.get('Response') != 'Success':
+                raise Exception("AMI login failed")
+        except Exception:
+            writer.close()
+            raise
+        
+        self._reader, self._writer = reader, writer
+        self._reader_task = asyncio.create_task(self._dispatch_responses(reader))
+        logger.info(f"Connected to Asterisk AMI at {self.asterisk_host}:{self.asterisk_port}")
+
+    async def close(self):
+        """Close the AMI connection"""
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._reader = None
+
+    async def notify_voice(self, alert: AlertData) -> bool:
         """
         Send voice alert via Asterisk AMI or simulator.
         
         Args:
             alert: Alert data containing risk information
-            
+        
         Returns:
             True if alert was sent successfully, False otherwise
         """
         if not self.ami_available:
-            return self._simulate_voice_alert(alert)
+            return await self._simulate_voice_alert(alert)
         
         try:
-            # Create short ID for the alert
-            short_id = alert.alert_id[-6:]  # Last 6 characters
-            
-            # Create TTS message (PHI-free)
-            message = f"High-risk cardiac score for case {short_id}. Check your secure portal."
-            
-            # Connect to Asterisk AMI
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(10)  # 10 second timeout
+            # Originate call; the message only carries the last 6 characters of the alert ID
+            message = ALERT_MESSAGE(short_id=alert.alert_id[-6:])
+            originate_cmd = ORIGINATE_FRAME(
+                number=self.alert_number,
+                message=message,
+                action_id=alert.alert_id
+            )
+            response = await self._send_action(alert.alert_id, originate_cmd)
             
+            if response.get('Response') == 'Success':
+                logger.info(f"Voice alert sent successfully for case {alert.alert_id}")
+                return True
+            else:
+                logger.error(f"AMI Originate failed: {response}")
+                return False
+        
+        except Exception as e:
+            logger.error(f"Voice alert failed: {e}")
+            return False
+
+    async def _send_action(self, action_id: str, command: str) -> Dict[str, str]:
+        """
+        Send an action over the persistent connection and await its response.
+        
+        An action that could not be written is retried once on a new connection.
+        One that was written is never resent: Asterisk may already have acted on
+        it, and a resent Originate would place a second call.
+        """
+        for attempt in range(2):
+            await self._ensure_connected()
             try:
-                sock.connect((self.asterisk_host, self.asterisk_port))
-                
-                # Read initial response
-                response = self._read_ami_response(sock)
-                if not response.startswith('Asterisk'):
-                    raise Exception("Invalid AMI response")
-                
-                # Login to AMI
-                login_cmd = f"Action: Login\r\nUsername: {self.asterisk_user}\r\nSecret: {self.asterisk_pass}\r\n\r\n"
-                sock.send(login_cmd.encode())
-                
-                response = self._read_ami_response(sock)
-                if 'Success' not in response:
-                    raise Exception("AMI login failed")
+                return await self._send_action_once(action_id, command)
+            except ActionNotSentError as e:
+                if attempt:
+                    raise
+                logger.warning(f"AMI action {action_id} was not sent ({e}), reconnecting and retrying")
+
+    async def _send_action_once(self, action_id: str, command: str) -> Dict[str, str]:
+        """Send an action and await its response, dropping the connection on failure"""
+        writer = self._writer
+        future = asyncio.get_running_loop().create_future()
+        self._pending[action_id] = future
+        sent = False
+        try:
+            writer.write(command.encode())
+            await writer.drain()
+            sent = True
+            return await asyncio.wait_for(future, timeout=AMI_TIMEOUT)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            # The socket may be half-open; close it so the next action reconnects
+            if self._writer is writer:
+                await self.close()
+            if not sent:
+                if future.done() and not future.cancelled():
+                    future.exception()  # Superseded by the error raised here
+                raise ActionNotSentError(repr(e)) from e
+            logger.warning(f"No AMI response for {action_id}; it may still have been delivered, so it is not resent")
+            raise
+        finally:
+            self._pending.pop(action_id, None)
+
+    async def _ensure_connected(self):
+        """Connect if needed, retrying with exponential backoff"""
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            
+            for attempt in range(RECONNECT_ATTEMPTS):
+                try:
+                    await self.connect()
+                    return
+                except Exception as e:
+                    if attempt == RECONNECT_ATTEMPTS - 1:
+                        raise
+                    delay = min(RECONNECT_BASE_DELAY * 2 ** attempt, RECONNECT_MAX_DELAY)
+                    logger.warning(f"AMI connect failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def _dispatch_responses(self, reader: asyncio.StreamReader):
+        """Route AMI responses to the pending action with the matching ActionID"""
+        try:
+            while True:
+                frame = await self._read_ami_frame(reader)
                 
-                # Originate call
-                originate_cmd = (
-                    f"Action: Originate\r\n"
-                    f"Channel: SIP/{self.alert_number}\r\n"
-                    f"Application: Playback\r\n"
-                    f"Data: {message}\r\n"
-                    f"Async: true\r\n\r\n"
-                )
-                sock.send(originate_cmd.encode())
+                # Events (e.g. OriginateResponse) reuse the ActionID; skip them without decoding
+                if frame.startswith(b"Event:"):
+                    continue
                 
-                response = self._read_ami_response(sock)
-                if 'Success' in response:
-                    logger.info(f"Voice alert sent successfully for case {alert.alert_id}")
-                    return True
-                else:
-                    logger.error(f"AMI Originate failed: {response}")
-                    return False
-                    
-            finally:
-                sock.close()
+                message = self._parse_ami_frame(frame)
+                if 'Response' not in message:
+                    continue
                 
+                future = self._pending.get(message.get('ActionID'))
+                if future and not future.done():
+                    future.set_result(message)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Voice alert failed: {e}")
-            return False
+            logger.warning(f"AMI connection lost: {e}")
+        finally:
+            if self._reader is reader:
+                if self._writer:
+                    self._writer.close()
+                self._reader = None
+                self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("AMI connection lost"))
 
-    def _read_ami_response(self, sock: socket.socket) -> str:
-        """Read AMI response from socket"""
-        response = b""
-        while True:
-            data = sock.recv(1024)
-            if not data:
-                break
-            response += data
-            if b"\r\n\r\n" in response:
-                break
-        return response.decode('utf-8', errors='ignore')
-    
-    def _simulate_voice_alert(self, alert: AlertData) -> bool:
+    async def _read_ami_frame(self, reader: asyncio.StreamReader) -> bytes:
+        """Read one raw AMI message, up to and including its blank-line terminator"""
+        return await reader.readuntil(b"\r\n\r\n")
+
+    def _parse_ami_frame(self, frame: bytes) -> Dict[str, str]:
+        """Decode an AMI message once and parse its headers"""
+        message = {}
+        for line in frame.decode('utf-8', errors='ignore').split("\r\n"):
+            key, sep, value = line.partition(":")
+            if sep:
+                message[key.strip()] = value.strip()
+        return message
+
+    async def _simulate_voice_alert(self, alert: AlertData) -> bool:
         """Simulate voice alert using system TTS"""
         try:
-            import subprocess
             import platform
             
-            # Create short ID for the alert
-            short_id = alert.alert_id[-6:]  # Last 6 characters
-            
-            # Create TTS message (PHI-free)
-            message = f"High-risk cardiac score for case {short_id}. Check your secure portal."
+            # Create TTS message (PHI-free) from the last 6 characters of the alert ID
+            message = ALERT_MESSAGE(short_id=alert.alert_id[-6:])
             
             logger.info(f"📞 SIMULATED VOIP CALL")
             logger.info(f"   📱 To: {self.alert_number or 'Unknown'}")
@@ -122,20 +255,28 @@ class VoIPNotifier:
             # Use system TTS if available
             if platform.system() == "Darwin":  # macOS
                 try:
-                    subprocess.run([
-                        "say", 
+                    process = await asyncio.create_subprocess_exec(
+                        "say",
                         "-v", "Alex",
                         "-r", "150",
                         message
-                    ], timeout=10, check=True)
+                    )
+                    try:
+                        returncode = await asyncio.wait_for(process.wait(), timeout=10)
+                    except asyncio.TimeoutError:
+                        process.kill()
+                        await process.wait()
+                        raise
+                    if returncode != 0:
+                        raise OSError(f"say exited with status {returncode}")
                     logger.info("   ✅ Voice message played successfully")
-                except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+                except (OSError, asyncio.TimeoutError):
                     logger.info("   📢 Text-to-speech not available")
             else:
                 logger.info("   📢 Text-to-speech not available on this system")
             
             return True
-            
+        
         except Exception as e:
             logger.error(f"Voice simulation failed: {e}")
             return False
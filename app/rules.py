@@ -1,11 +1,23 @@
 import os
 from .storage import storage
 
+# Read once at import; call reload_config() to pick up changes
+RISK_THRESHOLD = float(os.getenv('RISK_THRESHOLD', '0.80'))
 
-def should_alert(risk: float, patient_token: str) -> bool:
+
+def reload_config():
+    """Re-read the risk threshold from the environment"""
+    global RISK_THRESHOLD
+    RISK_THRESHOLD = float(os.getenv('RISK_THRESHOLD', '0.80'))
+
+
+async def should_alert(risk: float, patient_token: str) -> bool:
     """
     Determine if an alert should be sent based on risk threshold and cooldown.
     
+    When this returns True the patient's cooldown has already been claimed,
+    so callers must not set it again.
+    
     Args:
         risk: Predicted risk probability (0.0 to 1.0)
         patient_token: Patient reference token
@@ -13,15 +25,9 @@ def should_alert(risk: float, patient_token: str) -> bool:
     Returns:
         True if alert should be sent, False otherwise
     """
-    # Get risk threshold from environment
-    risk_threshold = float(os.getenv('RISK_THRESHOLD', '0.80'))
-    
     # Check if risk is above threshold
-    if risk < risk_threshold:
-        return False
-    
-    # Check if patient is in cooldown period
-    if storage.in_cooldown(patient_token):
+    if risk < RISK_THRESHOLD:
         return False
     
-    return True
+    # Claim the cooldown; fails if the patient is already in cooldown
+    return await storage.claim_cooldown(patient_token)
@@ -1,18 +1,25 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, field_validator
 from typing import Dict, Any, List, Optional
 
 
 class ScoreRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     patient_ref_token: str
     features: Dict[str, Any]
 
 
 class Factor(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     feature: str
     impact: float
 
 
 class ScoreResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     risk: float
     top_factors: List[Factor]
     alerted: bool
@@ -20,8 +27,21 @@ class ScoreResponse(BaseModel):
 
 
 class AlertData(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     alert_id: str
     patient_token: str
     risk: float
     top_factors: List[Factor]
-    timestamp: str
+    timestamp: float  # Unix epoch seconds
+    
+    @field_validator('timestamp', mode='before')
+    @classmethod
+    def _parse_iso_timestamp(cls, value):
+        """Accept ISO-8601 strings from alerts stored before epoch timestamps"""
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                return datetime.fromisoformat(value).timestamp()
+        return value
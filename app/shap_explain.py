@@ -3,10 +3,12 @@ import pandas as pd
 from typing import List, Dict, Any, Optional
 import logging
 
+from .deps import batch_features_to_frame, prepare_features
+
 logger = logging.getLogger(__name__)
 
 
-def explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str, Any]]:
+def explain_top_k(model, features: Dict[str, Any], k: int = 3, X=None) -> List[Dict[str, Any]]:
     """
     Generate SHAP explanations for top K features.
     Falls back gracefully if SHAP is not available or model is not supported.
@@ -15,16 +17,25 @@ def explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str,
         model: Trained scikit-learn model
         features: Dictionary of feature values
         k: Number of top features to return
+        X: Optional prepare_features() output for this row, reused if given
         
     Returns:
         List of dictionaries with 'feature' and 'impact' keys
     """
+    # Fast path: reuse the explainer cached on the model at load time
+    explainer = getattr(model, '_explainer', None)
+    if explainer is not None:
+        try:
+            return _explain_with_cached_explainer(model, explainer, features, k, X)
+        except Exception as e:
+            logger.warning(f"Cached explainer failed: {e}")
+
     try:
         import shap
-        
+
         # Convert features to DataFrame
         feature_df = pd.DataFrame([features])
-        
+
         # Try TreeExplainer for tree-based models
         if hasattr(model, 'tree_') or hasattr(model, 'estimators_'):
             try:
@@ -35,20 +46,8 @@ def explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str,
                 if isinstance(shap_values, list):
                     shap_values = shap_values[1]  # Positive class
                 
-                # Get feature names
-                feature_names = feature_df.columns.tolist()
-                
-                # Create feature importance pairs
-                feature_impacts = []
-                for i, (name, value) in enumerate(zip(feature_names, shap_values[0])):
-                    feature_impacts.append({
-                        'feature': name,
-                        'impact': float(abs(value))  # Use absolute value for impact
-                    })
-                
-                # Sort by impact and return top k
-                feature_impacts.sort(key=lambda x: x['impact'], reverse=True)
-                return feature_impacts[:k]
+                # Use absolute value for impact
+                return _top_k_impacts(feature_df.columns, np.abs(shap_values[0]), k)
                 
             except Exception as e:
                 logger.warning(f"TreeExplainer failed: {e}")
@@ -59,20 +58,7 @@ def explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str,
                 explainer = shap.LinearExplainer(model, feature_df)
                 shap_values = explainer.shap_values(feature_df)
                 
-                # Get feature names
-                feature_names = feature_df.columns.tolist()
-                
-                # Create feature importance pairs
-                feature_impacts = []
-                for i, (name, value) in enumerate(zip(feature_names, shap_values[0])):
-                    feature_impacts.append({
-                        'feature': name,
-                        'impact': float(abs(value))
-                    })
-                
-                # Sort by impact and return top k
-                feature_impacts.sort(key=lambda x: x['impact'], reverse=True)
-                return feature_impacts[:k]
+                return _top_k_impacts(feature_df.columns, np.abs(shap_values[0]), k)
                 
             except Exception as e:
                 logger.warning(f"LinearExplainer failed: {e}")
@@ -88,6 +74,31 @@ def explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str,
         return _permutation_importance_fallback(model, features, k)
 
 
+def _explain_with_cached_explainer(model, explainer, features: Dict[str, Any], k: int = 3, X=None) -> List[Dict[str, Any]]:
+    """
+    Explain using the explainer and preprocess step cached by load_model().
+    """
+    return _explain_batch_with_cached_explainer(model, explainer, [features], k, X)[0]
+
+
+def _explain_batch_with_cached_explainer(model, explainer, batch: List[Dict[str, Any]], k: int = 3, X=None) -> List[List[Dict[str, Any]]]:
+    """
+    Explain a whole batch with a single shap_values() call.
+    """
+    if X is None:
+        X = prepare_features(model, batch_features_to_frame(model, batch))
+    shap_values = explainer.shap_values(X)
+
+    # Handle binary classification (get positive class)
+    if isinstance(shap_values, list):
+        shap_values = shap_values[1]
+    elif np.ndim(shap_values) == 3:
+        shap_values = shap_values[..., 1]
+
+    impacts = np.abs(shap_values)
+    return [_top_k_impacts(model._feature_names, row, k) for row in impacts]
+
+
 def _permutation_importance_fallback(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str, Any]]:
     """
     Fallback method using simple feature importance or random sampling.
@@ -95,20 +106,7 @@ def _permutation_importance_fallback(model, features: Dict[str, Any], k: int = 3
     try:
         # Try to get feature importance from model
         if hasattr(model, 'feature_importances_'):
-            feature_names = list(features.keys())
-            importances = model.feature_importances_
-            
-            # Create feature importance pairs
-            feature_impacts = []
-            for name, importance in zip(feature_names, importances):
-                feature_impacts.append({
-                    'feature': name,
-                    'impact': float(importance)
-                })
-            
-            # Sort by impact and return top k
-            feature_impacts.sort(key=lambda x: x['impact'], reverse=True)
-            return feature_impacts[:k]
+            return _top_k_impacts(list(features.keys()), model.feature_importances_, k)
         
         # If no feature importance available, return empty list
         logger.warning("No feature importance available, returning empty explanation")
@@ -119,13 +117,50 @@ def _permutation_importance_fallback(model, features: Dict[str, Any], k: int = 3
         return []
 
 
-def safe_explain_top_k(model, features: Dict[str, Any], k: int = 3) -> List[Dict[str, Any]]:
+def _top_k_impacts(feature_names, impacts, k: int = 3) -> List[Dict[str, Any]]:
+    """
+    Return the k largest impacts as feature/impact dicts, largest first.
+    Selects with argpartition in O(N) and only sorts the k survivors.
+    """
+    names = np.asarray(feature_names, dtype=object)
+    impacts = np.asarray(impacts, dtype=np.float64)
+    
+    # Pair names and impacts positionally, like zip()
+    n = min(len(names), len(impacts))
+    names, impacts = names[:n], impacts[:n]
+    k = min(k, n)
+    if k <= 0:
+        return []
+    
+    idx = np.argpartition(-impacts, k - 1)[:k]
+    idx = np.sort(idx)
+    idx = idx[np.argsort(-impacts[idx], kind='stable')]
+    return [{'feature': str(name), 'impact': float(value)} for name, value in zip(names[idx], impacts[idx])]
+
+
+def safe_explain_top_k(model, features: Dict[str, Any], k: int = 3, X=None) -> List[Dict[str, Any]]:
     """
     Safe wrapper that never raises exceptions.
     Always returns a list, even if empty.
     """
     try:
-        return explain_top_k(model, features, k)
+        return explain_top_k(model, features, k, X)
     except Exception as e:
         logger.error(f"All explanation methods failed: {e}")
         return []
+
+
+def safe_explain_top_k_batch(model, batch: List[Dict[str, Any]], k: int = 3, X=None) -> List[List[Dict[str, Any]]]:
+    """
+    Batch variant of safe_explain_top_k.
+    Uses one explainer call for the whole batch when a cached explainer is
+    available, otherwise explains each row individually.
+    """
+    explainer = getattr(model, '_explainer', None)
+    if explainer is not None:
+        try:
+            return _explain_batch_with_cached_explainer(model, explainer, batch, k, X)
+        except Exception as e:
+            logger.warning(f"Cached batch explainer failed: {e}")
+    
+    return [safe_explain_top_k(model, features, k) for features in batch]
@@ -2,83 +2,112 @@ import os
 import json
 import time
 from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
-import redis
+import redis.asyncio as aioredis
+from pydantic import TypeAdapter
 from .schemas import AlertData
 
+# Serializes straight to JSON bytes in pydantic-core, skipping the str round-trip
+alert_adapter = TypeAdapter(AlertData)
+
 
 class Storage:
     def __init__(self):
         self.redis_client = None
         self.memory_store = {}
         self.cooldowns = {}
+        self.reload_config()
         
-        # Try to connect to Redis
+        # Set up a shared async connection pool; connections are opened lazily
         redis_url = os.getenv('REDIS_URL')
         if redis_url:
             try:
-                self.redis_client = redis.from_url(redis_url)
-                self.redis_client.ping()  # Test connection
+                max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+                pool = aioredis.ConnectionPool.from_url(redis_url, max_connections=max_connections)
+                self.redis_client = aioredis.Redis(connection_pool=pool)
             except Exception as e:
                 print(f"Redis connection failed, using in-memory storage: {e}")
                 self.redis_client = None
 
-    def in_cooldown(self, patient_token: str) -> bool:
-        """Check if patient is in cooldown period"""
+    def reload_config(self):
+        """Read the cooldown period from the environment"""
         cooldown_minutes = int(os.getenv('COOLDOWN_MINUTES', '30'))
-        
+        self.cooldown_seconds = cooldown_minutes * 60
+
+    async def connect(self):
+        """Test the Redis connection, falling back to in-memory storage on failure"""
         if self.redis_client:
             try:
+                await self.redis_client.ping()
+            except Exception as e:
+                print(f"Redis connection failed, using in-memory storage: {e}")
+                self.redis_client = None
+
+    async def close(self):
+        """Release pooled Redis connections"""
+        if self.redis_client:
+            await self.redis_client.aclose()
+
+    async def in_cooldown(self, patient_token: str) -> bool:
+        """Check if patient is in cooldown period"""
+        if self.redis_client:
+            try:
+                # The key expires with the cooldown, so its existence is the cooldown
                 cooldown_key = f"cooldown:{patient_token}"
-                last_alert = self.redis_client.get(cooldown_key)
-                if last_alert:
-                    last_alert_time = datetime.fromisoformat(last_alert.decode())
-                    return datetime.now() - last_alert_time < timedelta(minutes=cooldown_minutes)
-                return False
+                return bool(await self.redis_client.exists(cooldown_key))
             except Exception as e:
                 print(f"Redis cooldown check failed: {e}")
                 return False
         else:
             # In-memory fallback
-            if patient_token in self.cooldowns:
-                last_alert_time = self.cooldowns[patient_token]
-                return datetime.now() - last_alert_time < timedelta(minutes=cooldown_minutes)
-            return False
+            return self._in_memory_cooldown(patient_token)
 
-    def set_cooldown(self, patient_token: str):
-        """Set cooldown for patient"""
-        now = datetime.now()
+    async def claim_cooldown(self, patient_token: str) -> bool:
+        """
+        Atomically start a cooldown for patient if none is active.
         
+        Returns:
+            True if the cooldown was claimed (caller should alert),
+            False if the patient was already in cooldown
+        """
         if self.redis_client:
             try:
+                # SET NX EX checks and sets in one round-trip, so concurrent scorers can't both claim
                 cooldown_key = f"cooldown:{patient_token}"
-                self.redis_client.set(cooldown_key, now.isoformat())
+                return bool(await self.redis_client.set(cooldown_key, int(time.time()), nx=True, ex=self.cooldown_seconds))
             except Exception as e:
-                print(f"Redis cooldown set failed: {e}")
-                self.cooldowns[patient_token] = now
-        else:
-            self.cooldowns[patient_token] = now
+                print(f"Redis cooldown claim failed: {e}")
+        
+        # In-memory fallback
+        if self._in_memory_cooldown(patient_token):
+            return False
+        self.cooldowns[patient_token] = time.monotonic()
+        return True
+
+    def _in_memory_cooldown(self, patient_token: str) -> bool:
+        """Check the in-memory cooldown store (monotonic seconds, immune to clock changes)"""
+        last_alert_time = self.cooldowns.get(patient_token)
+        return last_alert_time is not None and time.monotonic() - last_alert_time < self.cooldown_seconds
 
-    def save_alert(self, alert: AlertData):
+    async def save_alert(self, alert: AlertData):
         """Save alert data"""
         if self.redis_client:
             try:
                 alert_key = f"alert:{alert.alert_id}"
-                self.redis_client.set(alert_key, alert.model_dump_json())
+                await self.redis_client.set(alert_key, alert_adapter.dump_json(alert))
             except Exception as e:
                 print(f"Redis alert save failed: {e}")
                 self.memory_store[alert.alert_id] = alert
         else:
             self.memory_store[alert.alert_id] = alert
 
-    def get_alert(self, alert_id: str) -> Optional[AlertData]:
+    async def get_alert(self, alert_id: str) -> Optional[AlertData]:
         """Get alert by ID"""
         if self.redis_client:
             try:
                 alert_key = f"alert:{alert_id}"
-                alert_data = self.redis_client.get(alert_key)
+                alert_data = await self.redis_client.get(alert_key)
                 if alert_data:
-                    return AlertData.model_validate_json(alert_data)
+                    return alert_adapter.validate_json(alert_data)
                 return None
             except Exception as e:
                 print(f"Redis alert get failed: {e}")
@@ -11,9 +11,14 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
 
+# Copy-on-write lets rename/drop share data instead of copying it (always on in pandas >= 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
 
 DATA_URL = "https://raw.githubusercontent.com/hadt222/CSCE_5380/refs/heads/main/heart-3.csv"
 DEFAULT_OUTPUT_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(__file__), "heart_pipeline.joblib"))
+DEFAULT_ONNX_PATH = os.path.splitext(DEFAULT_OUTPUT_PATH)[0] + ".onnx"
 
 
 def load_data() -> pd.DataFrame:
@@ -21,13 +26,19 @@ def load_data() -> pd.DataFrame:
     data_path = os.getenv("DATA_PATH", DATA_URL)
     df = pd.read_csv(data_path)
     
-    # Basic cleaning
-    df = df.drop_duplicates()
-    df.columns = [c.strip() for c in df.columns]  # normalize column names
+    # Normalize column names and rename thalch -> thalach (for consistency
+    # with the API) in a single rename
+    stripped = {c.strip() for c in df.columns}
+    rename_thalch = "thalch" in stripped and "thalach" not in stripped
+    
+    def normalize(column: str) -> str:
+        column = column.strip()
+        return "thalach" if rename_thalch and column == "thalch" else column
     
-    # Rename thalch -> thalach for consistency with API
-    if "thalch" in df.columns and "thalach" not in df.columns:
-        df = df.rename(columns={"thalch": "thalach"})
+    df = df.rename(columns=normalize)
+    
+    # Basic cleaning
+    df = df.drop_duplicates(ignore_index=True)
     
     return df
 
@@ -68,7 +79,8 @@ def train_and_save_model() -> str:
     
     categorical_pipe = Pipeline(steps=[
         ('imputer', SimpleImputer(strategy='most_frequent')),
-        ('ohe', OneHotEncoder(handle_unknown='ignore'))
+        # Dense output so inference gets a contiguous matrix without sparse conversion
+        ('ohe', OneHotEncoder(handle_unknown='ignore', sparse_output=False))
     ])
     
     # Column transformer
@@ -88,7 +100,7 @@ def train_and_save_model() -> str:
     # Create the full pipeline with Random Forest (best model from notebook)
     pipeline = Pipeline(steps=[
         ('preprocess', preprocess),
-        ('clf', RandomForestClassifier(n_estimators=200, random_state=42))
+        ('clf', RandomForestClassifier(n_estimators=200, random_state=42, n_jobs=-1))
     ])
     
     # Train the model
@@ -107,9 +119,39 @@ def train_and_save_model() -> str:
     joblib.dump(pipeline, DEFAULT_OUTPUT_PATH)
     print(f"\nModel saved to: {DEFAULT_OUTPUT_PATH}")
     
+    # Export the classifier for compiled scoring (optional)
+    export_onnx_classifier(pipeline, DEFAULT_ONNX_PATH)
+    
     return DEFAULT_OUTPUT_PATH
 
 
+def export_onnx_classifier(pipeline: Pipeline, output_path: str) -> bool:
+    """
+    Export the fitted classifier to ONNX so the API can score it with ONNX Runtime.
+    The preprocess step stays in scikit-learn; the exported graph takes its
+    transformed float output as input.
+    """
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        print("skl2onnx not installed, skipping ONNX export")
+        return False
+    
+    clf = pipeline.named_steps['clf']
+    n_features = len(pipeline.named_steps['preprocess'].get_feature_names_out())
+    onnx_model = convert_sklearn(
+        clf,
+        initial_types=[('input', FloatTensorType([None, n_features]))],
+        options={id(clf): {'zipmap': False}}
+    )
+    
+    with open(output_path, "wb") as f:
+        f.write(onnx_model.SerializeToString())
+    print(f"ONNX classifier saved to: {output_path}")
+    return True
+
+
 if __name__ == "__main__":
     train_and_save_model()
 
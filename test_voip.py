@@ -4,6 +4,7 @@ Test script for VoIP functionality
 """
 import os
 import sys
+import asyncio
 from dotenv import load_dotenv
 
 # Add app directory to path
@@ -54,7 +55,7 @@ def test_voip_alert():
             Factor(feature="cp", impact=0.12),
             Factor(feature="oldpeak", impact=0.10)
         ],
-        timestamp="2024-01-01T12:00:00"
+        timestamp=1704110400.0
     )
     
     # Test notifier
@@ -67,7 +68,7 @@ def test_voip_alert():
     
     if notifier.ami_available:
         print("🚀 Attempting to send VoIP alert...")
-        success = notifier.notify_voice(test_alert)
+        success = asyncio.run(notifier.notify_voice(test_alert))
         
         if success:
             print("✅ VoIP alert sent successfully!")
@@ -75,7 +76,7 @@ def test_voip_alert():
             print("❌ Failed to send VoIP alert")
     else:
         print("📱 Simulating VoIP alert (AMI not configured)")
-        success = notifier.notify_voice(test_alert)
+        success = asyncio.run(notifier.notify_voice(test_alert))
         print(f"✅ Simulation result: {success}")
 
 def main():
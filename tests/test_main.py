@@ -1,3 +1,5 @@
+import os
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
@@ -66,9 +68,266 @@ def test_score_endpoint_with_model():
         pytest.skip("Model not loaded, skipping score test")
 
 
+def test_score_endpoint_explain_flag():
+    """Test explanations are returned when explicitly requested"""
+    try:
+        from app.deps import get_model
+        get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping explain test")
+    
+    pytest.importorskip("shap")
+    sample_data = {
+        "patient_ref_token": "explain_patient_123",
+        "features": {
+            "age": 40, "sex": 0, "cp": 0, "trestbps": 120, "chol": 180,
+            "fbs": 0, "restecg": 0, "thalach": 170, "exang": 0,
+            "oldpeak": 0.0, "slope": 0, "ca": 0, "thal": 1
+        }
+    }
+    
+    response = client.post("/score?explain=true", json=sample_data)
+    assert response.status_code == 200
+    assert len(response.json()["top_factors"]) > 0
+
+
+def test_score_missing_features_rejected():
+    """Test requests with missing features get a 422 instead of imputed values"""
+    try:
+        from app.deps import get_model
+        get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping missing features test")
+    
+    features = {
+        "age": 65, "sex": 1, "trestbps": 145,
+        "fbs": 1, "restecg": 0, "thalach": 150, "exang": 0,
+        "oldpeak": 2.3, "slope": 0, "ca": 0, "thal": 1
+    }
+    response = client.post("/score", json={"patient_ref_token": "missing_patient", "features": features})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Missing features: chol, cp"
+    
+    batch = [
+        {"patient_ref_token": "missing_batch_1", "features": dict(features, cp=3, chol=233)},
+        {"patient_ref_token": "missing_batch_2", "features": features},
+    ]
+    response = client.post("/score_batch", json=batch)
+    assert response.status_code == 422
+    assert response.json()["detail"] == "Missing features for patient 1: chol, cp"
+
+
+def test_score_null_features_imputed():
+    """Test features sent as null are filled in by the pipeline's imputers and scored"""
+    try:
+        from app.deps import get_model
+        get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping null features test")
+    
+    features = {
+        "age": 65, "sex": 1, "cp": 3, "trestbps": 145, "chol": 233,
+        "fbs": 1, "restecg": 0, "thalach": 150, "exang": 0,
+        "oldpeak": 2.3, "slope": 0, "ca": None, "thal": None
+    }
+    response = client.post("/score", json={"patient_ref_token": "null_patient", "features": features})
+    assert response.status_code == 200
+    assert 0 <= response.json()["risk"] <= 1
+
+
+def test_score_batch_endpoint_with_model():
+    """Test batch score endpoint returns one response per patient"""
+    try:
+        from app.deps import get_model
+        get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping batch score test")
+    
+    features = {
+        "age": 65, "sex": 1, "cp": 3, "trestbps": 145, "chol": 233,
+        "fbs": 1, "restecg": 0, "thalach": 150, "exang": 0,
+        "oldpeak": 2.3, "slope": 0, "ca": 0, "thal": 1
+    }
+    batch = [
+        {"patient_ref_token": "batch_patient_1", "features": features},
+        {"patient_ref_token": "batch_patient_2", "features": dict(features, age=40)},
+    ]
+    
+    response = client.post("/score_batch", json=batch)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 2
+    for item in data:
+        assert 0 <= item["risk"] <= 1
+        assert "top_factors" in item
+        assert "alerted" in item
+
+
+def test_score_batch_empty():
+    """Test batch score endpoint with an empty batch"""
+    response = client.post("/score_batch", json=[])
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_explainer_cached_on_model():
+    """Test SHAP explainer is built once at model load"""
+    try:
+        from app.deps import get_model
+        model = get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping explainer test")
+    
+    pytest.importorskip("shap")
+    assert getattr(model, "_explainer", None) is not None
+    assert len(model._feature_names) > 0
+
+
+def test_onnx_scorer_matches_sklearn_at_threshold():
+    """Test compiled scorer agrees with the sklearn pipeline, including scores exactly at the threshold"""
+    import numpy as np
+    from app import rules
+    from app.deps import batch_features_to_frame, prepare_features, predict_risk
+    try:
+        from app.deps import get_model
+        model = get_model()
+    except RuntimeError:
+        pytest.skip("Model not loaded, skipping ONNX parity test")
+    if getattr(model, "_onnx_session", None) is None:
+        pytest.skip("ONNX scorer not loaded, skipping parity test")
+    
+    rng = np.random.default_rng(0)
+    ranges = {
+        "age": (29, 78), "sex": (0, 2), "cp": (0, 4), "trestbps": (94, 200), "chol": (126, 565),
+        "fbs": (0, 2), "restecg": (0, 3), "thalach": (71, 203), "exang": (0, 2),
+        "slope": (0, 3), "ca": (0, 4), "thal": (0, 4)
+    }
+    batch = [
+        dict({name: int(rng.integers(low, high)) for name, (low, high) in ranges.items()},
+             oldpeak=float(rng.uniform(0, 6)))
+        for _ in range(2000)
+    ]
+    features_df = batch_features_to_frame(model, batch)
+    onnx_risk = predict_risk(model, prepare_features(model, features_df))
+    sklearn_risk = model.predict_proba(features_df)[:, 1]
+    
+    assert np.allclose(onnx_risk, sklearn_risk, atol=1e-6)
+    # A forest vote of exactly k/n_trees, e.g. 0.80, must not drift below the threshold
+    np.testing.assert_array_equal(onnx_risk >= rules.RISK_THRESHOLD, sklearn_risk >= rules.RISK_THRESHOLD)
+    
+    on_grid = sklearn_risk == np.round(sklearn_risk * model._onnx_vote_grid) / model._onnx_vote_grid
+    np.testing.assert_array_equal(onnx_risk[on_grid], sklearn_risk[on_grid])
+
+
+def test_top_k_impacts():
+    """Test top-k selection returns the largest impacts in descending order"""
+    from app.shap_explain import _top_k_impacts
+    
+    names = ["a", "b", "c", "d", "e"]
+    impacts = [0.1, 0.5, 0.3, 0.9, 0.2]
+    
+    top = _top_k_impacts(names, impacts, k=3)
+    assert [f["feature"] for f in top] == ["d", "b", "c"]
+    assert top[0]["impact"] == 0.9
+    assert len(_top_k_impacts(names, impacts, k=10)) == 5
+    assert _top_k_impacts([], [], k=3) == []
+
+
+def test_claim_cooldown_once():
+    """Test cooldown can only be claimed once per patient"""
+    from app.storage import Storage
+    
+    async def run():
+        store = Storage()
+        assert not await store.in_cooldown("cooldown_patient")
+        assert await store.claim_cooldown("cooldown_patient") is True
+        assert await store.claim_cooldown("cooldown_patient") is False
+        assert await store.in_cooldown("cooldown_patient")
+    
+    asyncio.run(run())
+
+
+def test_concurrent_should_alert_claims_once():
+    """Test concurrent alert checks for a repeated token, as in /score_batch, alert only once"""
+    from app.rules import should_alert
+    
+    async def run():
+        return await asyncio.gather(*(should_alert(0.99, "concurrent_patient") for _ in range(5)))
+    
+    assert sorted(asyncio.run(run())) == [False, False, False, False, True]
+
+
+def test_reload_config(monkeypatch):
+    """Test config reload picks up new environment values"""
+    from app import main, rules
+    from app.storage import storage
+    
+    # Keep a local .env from overriding the patched values
+    monkeypatch.setattr(main, "_reload_dotenv", lambda: None)
+    monkeypatch.setenv("CONFIG_RELOAD_TOKEN", "reload-secret")
+    monkeypatch.setenv("RISK_THRESHOLD", "0.5")
+    monkeypatch.setenv("COOLDOWN_MINUTES", "5")
+    try:
+        response = client.post("/reload-config", headers={"X-Reload-Token": "reload-secret"})
+        assert response.status_code == 200
+        assert response.json() == {"risk_threshold": 0.5, "cooldown_minutes": 5, "pid": os.getpid()}
+        assert rules.RISK_THRESHOLD == 0.5
+        assert storage.cooldown_seconds == 300
+    finally:
+        monkeypatch.undo()
+        rules.reload_config()
+        storage.reload_config()
+
+
+def test_reload_config_requires_token(monkeypatch):
+    """Test config reload is disabled without a token and rejects a wrong one"""
+    from app import main
+    
+    monkeypatch.setattr(main, "_reload_dotenv", lambda: None)
+    monkeypatch.delenv("CONFIG_RELOAD_TOKEN", raising=False)
+    assert client.post("/reload-config").status_code == 403
+    
+    monkeypatch.setenv("CONFIG_RELOAD_TOKEN", "reload-secret")
+    assert client.post("/reload-config").status_code == 401
+    assert client.post("/reload-config", headers={"X-Reload-Token": "wrong"}).status_code == 401
+
+
+def test_reload_dotenv_keeps_process_env(monkeypatch):
+    """Test .env values never override variables set by the deployment"""
+    from app import main
+    
+    monkeypatch.setenv("RISK_THRESHOLD", "0.9")
+    monkeypatch.delenv("COOLDOWN_MINUTES", raising=False)
+    monkeypatch.setattr(main, "PROCESS_ENV_KEYS", frozenset({"RISK_THRESHOLD"}))
+    monkeypatch.setattr(main, "dotenv_values", lambda: {"RISK_THRESHOLD": "0.5", "COOLDOWN_MINUTES": "5"})
+    
+    main._reload_dotenv()
+    assert main.os.environ["RISK_THRESHOLD"] == "0.9"
+    assert main.os.environ["COOLDOWN_MINUTES"] == "5"
+
+
 def test_case_not_found():
     """Test case endpoint with non-existent token"""
     response = client.get("/case/nonexistent")
     assert response.status_code == 404
 
 
+def test_case_view_renders_alert():
+    """Test case endpoint renders a stored alert from the cached template"""
+    from app.schemas import AlertData, Factor
+    from app.storage import storage
+    
+    alert = AlertData(
+        alert_id="alrt_casetest",
+        patient_token="case_patient",
+        risk=0.91,
+        top_factors=[Factor(feature="oldpeak", impact=0.12)],
+        timestamp=1704110400.0
+    )
+    asyncio.run(storage.save_alert(alert))
+    
+    response = client.get("/case/alrt_casetest")
+    assert response.status_code == 200
+    assert "text/html" in response.headers["content-type"]
+    assert "oldpeak" in response.text
+    assert "91.0%" in response.text
@@ -0,0 +1,182 @@
+import asyncio
+
+from app import notifier as notifier_module
+from app.notifier import VoIPNotifier
+from app.schemas import AlertData
+
+
+class FakeAMI:
+    """
+    Minimal AMI server. `handle_action(conn, headers)` returns the frames to send
+    back, empty to stay silent; a "close" entry hangs up after the frames before it.
+    """
+    
+    def __init__(self, handle_action, banner=b"Asterisk Call Manager/5.0.1\r\n"):
+        self.handle_action = handle_action
+        self.banner = banner
+        self.connections = 0
+        self.actions = []
+        self.server = None
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+    
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        conn = self.connections
+        writer.write(self.banner)
+        try:
+            while True:
+                frame = await reader.readuntil(b"\r\n\r\n")
+                headers = dict(line.split(": ", 1) for line in frame.decode().strip().split("\r\n"))
+                if headers["Action"] == "Login":
+                    writer.write(b"Response: Success\r\nMessage: Authentication accepted\r\n\r\n")
+                    continue
+                
+                self.actions.append((conn, headers["ActionID"]))
+                replies = self.handle_action(conn, headers)
+                for reply in replies:
+                    if reply == "close":
+                        break
+                    writer.write(reply)
+                await writer.drain()
+                if "close" in replies:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _success(action_id):
+    return f"Response: Success\r\nActionID: {action_id}\r\nMessage: Originate successfully queued\r\n\r\n".encode()
+
+
+def _event(action_id):
+    return f"Event: OriginateResponse\r\nActionID: {action_id}\r\nResponse: Failure\r\n\r\n".encode()
+
+
+def _alert(alert_id):
+    return AlertData(alert_id=alert_id, patient_token="ami_patient", risk=0.9, top_factors=[], timestamp=0.0)
+
+
+def _make_notifier(port):
+    voip = VoIPNotifier()
+    voip.asterisk_host = "127.0.0.1"
+    voip.asterisk_port = port
+    voip.asterisk_user = "user"
+    voip.asterisk_pass = "secret"
+    voip.alert_number = "1000"
+    voip.ami_available = True
+    return voip
+
+
+def _run_with_server(server, scenario):
+    """Start the fake server, run scenario(notifier), then shut both down"""
+    async def run():
+        port = await server.start()
+        voip = _make_notifier(port)
+        try:
+            return await scenario(voip)
+        finally:
+            await voip.close()
+            await server.stop()
+    
+    return asyncio.run(run())
+
+
+def test_responses_routed_by_action_id():
+    """Test out-of-order responses reach the right caller and events sharing the ActionID are skipped"""
+    held = []
+    
+    def handle_action(conn, headers):
+        held.append(headers["ActionID"])
+        if len(held) < 2:
+            return []
+        # Answer both in reverse order, each preceded by an event reusing its ActionID
+        return [frame for action_id in reversed(held) for frame in (_event(action_id), _success(action_id))]
+    
+    server = FakeAMI(handle_action)
+    results = _run_with_server(server, lambda voip: asyncio.gather(
+        voip.notify_voice(_alert("alrt_first1")),
+        voip.notify_voice(_alert("alrt_secnd2"))
+    ))
+    
+    assert results == [True, True]
+    assert server.connections == 1
+
+
+def test_reconnect_after_server_hangs_up():
+    """Test the next action reconnects after the server closes an idle connection"""
+    def handle_action(conn, headers):
+        if conn == 1 and headers["ActionID"] == "alrt_secnd2":
+            return [_success(headers["ActionID"]), "close"]
+        return [_success(headers["ActionID"])]
+    
+    async def scenario(voip):
+        results = [await voip.notify_voice(_alert(alert_id)) for alert_id in ("alrt_first1", "alrt_secnd2")]
+        await asyncio.sleep(0.1)
+        return results + [await voip.notify_voice(_alert("alrt_third3"))]
+    
+    server = FakeAMI(handle_action)
+    assert _run_with_server(server, scenario) == [True, True, True]
+    assert server.actions == [(1, "alrt_first1"), (1, "alrt_secnd2"), (2, "alrt_third3")]
+
+
+def test_unsent_action_retried():
+    """Test an action that could not be written is retried once on a new connection"""
+    async def scenario(voip):
+        results = [await voip.notify_voice(_alert("alrt_first1"))]
+        
+        def broken_write(data):
+            raise ConnectionResetError("Connection lost")
+        
+        voip._writer.write = broken_write
+        return results + [await voip.notify_voice(_alert("alrt_secnd2"))]
+    
+    server = FakeAMI(lambda conn, headers: [_success(headers["ActionID"])])
+    assert _run_with_server(server, scenario) == [True, True]
+    assert server.actions == [(1, "alrt_first1"), (2, "alrt_secnd2")]
+
+
+def test_action_lost_after_send_not_resent():
+    """Test an action the server received before hanging up fails instead of placing a second call"""
+    def handle_action(conn, headers):
+        return ["close"] if headers["ActionID"] == "alrt_secnd2" else [_success(headers["ActionID"])]
+    
+    async def scenario(voip):
+        return [await voip.notify_voice(_alert(alert_id)) for alert_id in ("alrt_first1", "alrt_secnd2", "alrt_third3")]
+    
+    server = FakeAMI(handle_action)
+    assert _run_with_server(server, scenario) == [True, False, True]
+    assert server.actions == [(1, "alrt_first1"), (1, "alrt_secnd2"), (2, "alrt_third3")]
+
+
+def test_timeout_drops_half_open_connection(monkeypatch):
+    """Test a silent connection is closed on timeout without resending, and the next action reconnects"""
+    monkeypatch.setattr(notifier_module, "AMI_TIMEOUT", 0.2)
+    
+    def handle_action(conn, headers):
+        return [] if conn == 1 else [_success(headers["ActionID"])]
+    
+    async def scenario(voip):
+        return [await voip.notify_voice(_alert(alert_id)) for alert_id in ("alrt_first1", "alrt_secnd2")]
+    
+    server = FakeAMI(handle_action)
+    assert _run_with_server(server, scenario) == [False, True]
+    assert server.actions == [(1, "alrt_first1"), (2, "alrt_secnd2")]
+
+
+def test_connect_backoff_gives_up(monkeypatch):
+    """Test connecting retries with backoff and the alert fails once every attempt is rejected"""
+    monkeypatch.setattr(notifier_module, "RECONNECT_BASE_DELAY", 0.01)
+    
+    server = FakeAMI(lambda conn, headers: [_success(headers["ActionID"])], banner=b"Not Asterisk\r\n")
+    assert _run_with_server(server, lambda voip: voip.notify_voice(_alert("alrt_first1"))) is False
+    assert server.connections == notifier_module.RECONNECT_ATTEMPTS
+    assert server.actions == []
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import subprocess
+import pytest
+
+import voip_simulator
+from voip_simulator import VoIPSimulator, _render_alert, _wait_process
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "voip_simulator.py")
+
+
+def _run_simulator(*args, **env):
+    """Run the simulator script and return the completed process"""
+    return subprocess.run(
+        [sys.executable, SIMULATOR, *args],
+        capture_output=True,
+        env=dict(os.environ, **env),
+        timeout=30
+    )
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="pidfd_open not available")
+def test_wait_process_exit():
+    """Test _wait_process returns the exit status once the child exits"""
+    proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+    assert _wait_process(proc, timeout=10) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="pidfd_open not available")
+def test_wait_process_timeout():
+    """Test _wait_process raises TimeoutExpired without waiting for the child"""
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        started = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            _wait_process(proc, timeout=0.2)
+        assert time.monotonic() - started < 5
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_fast_self_test():
+    """Test --fast runs the self-test without TTS or waiting"""
+    result = _run_simulator("--fast", "--repeat", "3", PYTHONIOENCODING="utf-8")
+    assert result.returncode == 0
+    output = result.stdout.decode("utf-8")
+    assert "3 calls in" in output
+    assert "VoIP Simulator test completed!" in output
+    assert "Duration" not in output
+
+
+def test_ascii_fallback():
+    """Test banners fall back to ASCII when stdout can't encode emoji"""
+    result = _run_simulator("--fast", PYTHONIOENCODING="ascii")
+    assert result.returncode == 0
+    output = result.stdout.decode("ascii")
+    assert "[CALL] SIMULATED VOIP CALL" in output
+    assert "[OK] VoIP Simulator test completed!" in output
+
+
+def test_render_alert():
+    """Test the alert template renders the standard message"""
+    assert _render_alert("cardiac", "ABC123") == "High-risk cardiac score for case ABC123. Check your secure portal."
+    assert _render_alert("cardiac", "ABC123") is _render_alert("cardiac", "ABC123")
+
+
+def _stub_simulator(monkeypatch, tmp_path):
+    """Build a voice-enabled simulator whose say/afplay commands are recorded, not run"""
+    monkeypatch.setattr(voip_simulator, "_VOICE_ENABLED", True)
+    monkeypatch.setattr(voip_simulator, "TTS_CACHE_DIR", tmp_path)
+    simulator = VoIPSimulator(duration=0)
+    commands = []
+    
+    async def run_command(*args, timeout=10):
+        commands.append(args)
+        if args[0] == "say":
+            with open(args[args.index("-o") + 1], "w") as f:
+                f.write("audio")
+    
+    simulator._run_command = run_command
+    return simulator, commands
+
+
+def test_audio_cache_key_and_reuse(monkeypatch, tmp_path):
+    """Test audio is keyed by voice, rate and message and only synthesized once"""
+    simulator, commands = _stub_simulator(monkeypatch, tmp_path)
+    message = _render_alert("cardiac", "ABC123")
+    
+    async def run():
+        await simulator.make_call("555-123-4567", message)
+        await simulator.make_call("555-123-4567", message)
+    
+    asyncio.run(run())
+    
+    key = hashlib.sha256(f"Alex|150|{message}".encode()).hexdigest()
+    assert simulator._audio_key(message) == key
+    assert [f.name for f in tmp_path.iterdir()] == [f"{key}.aiff"]
+    assert [args[0] for args in commands] == ["say", "afplay", "afplay"]
+    
+    # A fresh simulator picks the file up from disk instead of synthesizing again
+    other, other_commands = _stub_simulator(monkeypatch, tmp_path)
+    asyncio.run(other.make_call("555-123-4567", message))
+    assert [args[0] for args in other_commands] == ["afplay"]
+
+
+def test_audio_cache_eviction(monkeypatch, tmp_path):
+    """Test the least recently used audio files are evicted beyond the limit"""
+    monkeypatch.setattr(voip_simulator, "TTS_CACHE_MAX_FILES", 2)
+    simulator, _ = _stub_simulator(monkeypatch, tmp_path)
+    old, mid, new = (_render_alert("cardiac", case_id) for case_id in ("OLD001", "MID002", "NEW003"))
+    
+    for age, message in enumerate((old, mid)):
+        asyncio.run(simulator.make_call("555-123-4567", message))
+        path = tmp_path / f"{simulator._audio_key(message)}.aiff"
+        os.utime(path, (1000 + age, 1000 + age))
+    
+    asyncio.run(simulator.make_call("555-123-4567", new))
+    
+    remaining = {f.name for f in tmp_path.iterdir()}
+    assert remaining == {f"{simulator._audio_key(message)}.aiff" for message in (mid, new)}
+    assert simulator._audio_key(old) not in simulator._audio_cache
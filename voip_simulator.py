@@ -3,82 +3,366 @@
 Simple VoIP Simulator for Mac M1
 Simulates VoIP calls without requiring Asterisk
 """
+from __future__ import annotations
+
 import os
+import sys
 import time
-import subprocess
+import asyncio
+import argparse
+import select
+import shutil
+import hashlib
+import functools
 import platform
-from typing import Optional
+import selectors
+import tempfile
+import subprocess
+from pathlib import Path
+
+# TTS voice settings; both are part of the audio cache key
+VOICE = "Alex"
+RATE = 150
+
+# Synthesized messages kept on disk, least recently used are evicted first
+TTS_CACHE_DIR = Path.home() / ".cache" / "voip_alert"
+TTS_CACHE_MAX_FILES = 256
+
+# Alert message template; rendered messages are memoized so repeat alerts reuse the same string
+ALERT_TEMPLATE = "High-risk {kind} score for case {case_id}. Check your secure portal."
+
+@functools.lru_cache(maxsize=1024)
+def _render_alert(kind: str, case_id: str) -> str:
+    """Render ALERT_TEMPLATE for one alert type and case"""
+    return ALERT_TEMPLATE.format_map({"kind": kind, "case_id": case_id})
+
+# say's inline pause between messages spoken in one batch
+BATCH_SEPARATOR = " [[slnc 500]] "
+
+# Platform and TTS availability don't change at runtime, so detect them once at import
+_SYSTEM = platform.system()
+_VOICE_ENABLED = _SYSTEM == "Darwin" and shutil.which("say") is not None  # macOS only
+
+# Emoji only when stdout can encode them (not e.g. cp1252 consoles or ASCII cron logs); chosen once at import
+_EMOJI = (getattr(sys.stdout, "encoding", None) or "").lower().startswith("utf")
+_ICONS = {
+    "call": "📞", "to": "📱", "message": "💬", "timer": "⏱️ ", "ok": "✅",
+    "warn": "⚠️ ", "error": "❌", "info": "📢", "test": "🔧", "app": "🏥"
+} if _EMOJI else {
+    "call": "[CALL]", "to": "-", "message": "-", "timer": "-", "ok": "[OK]",
+    "warn": "[WARN]", "error": "[ERROR]", "info": "[INFO]", "test": "[TEST]", "app": "[APP]"
+}
+
+def _wait_process(proc: subprocess.Popen, timeout: float) -> int:
+    """
+    Wait for proc to exit on a kernel event instead of Popen.wait()'s sleep/poll loop.
+    Uses pidfd on Linux and kqueue on macOS, falling back to Popen.wait().
+    Raises subprocess.TimeoutExpired like Popen.wait().
+    """
+    if proc.poll() is not None:
+        return proc.returncode
+    
+    try:
+        if hasattr(os, "pidfd_open"):
+            pidfd = os.pidfd_open(proc.pid)
+            try:
+                with selectors.DefaultSelector() as selector:
+                    selector.register(pidfd, selectors.EVENT_READ)
+                    exited = bool(selector.select(timeout))
+            finally:
+                os.close(pidfd)
+        elif hasattr(select, "kqueue"):
+            kq = select.kqueue()
+            try:
+                event = select.kevent(
+                    proc.pid,
+                    filter=select.KQ_FILTER_PROC,
+                    flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                    fflags=select.KQ_NOTE_EXIT
+                )
+                exited = bool(kq.control([event], 1, timeout))
+            finally:
+                kq.close()
+        else:
+            return proc.wait(timeout=timeout)
+    except OSError:
+        # pidfd_open needs Linux 5.3+; kevent fails if the process is already gone
+        return proc.wait(timeout=timeout)
+    
+    if not exited:
+        raise subprocess.TimeoutExpired(proc.args, timeout)
+    return proc.wait()
 
 class VoIPSimulator:
-    def __init__(self):
-        self.system = platform.system()
-        self.voice_enabled = self._check_voice_capability()
+    # Fixed console lines, built once; only the per-call details are formatted
+    _BANNER = f"{_ICONS['call']} SIMULATED VOIP CALL\n"
+    _TO = f"   {_ICONS['to']} To: "
+    _MESSAGE = f"   {_ICONS['message']} Message: "
+    _DURATION = f"   {_ICONS['timer']} Duration: {{:g}} seconds\n"
+    _ENDED = f"   {_ICONS['call']} Call ended\n"
+    _PLAYED = f"   {_ICONS['ok']} Voice message played successfully\n"
+    _TIMED_OUT = f"   {_ICONS['warn']} Voice message timed out\n"
+    _VOICE_ERROR = f"   {_ICONS['error']} Voice error: "
+    _NO_VOICE = f"   {_ICONS['info']} Text-to-speech not available on this system\n"
+    _TEST_HEADER = f"{_ICONS['test']} Testing VoIP Simulator...\n"
+    
+    def __init__(self, voice: bool | None = None, duration: float | None = None):
+        """
+        Args:
+            voice: Set False to skip TTS even where it is available
+            duration: Fake call duration in seconds, defaults to VOIP_SIM_DURATION
+        """
+        self.system = _SYSTEM
+        self.voice_enabled = _VOICE_ENABLED if voice is None else voice and _VOICE_ENABLED
+        
+        # Fake call duration in seconds; 0 skips the wait (set to 2 for demos)
+        if duration is None:
+            duration = float(os.getenv('VOIP_SIM_DURATION', '0'))
+        self.sim_duration = duration
+        # Banner line for the configured duration; omitted when calls don't wait
+        self._duration_line = self._DURATION.format(duration) if duration else ""
+        
+        # Alert messages repeat, so synthesize each one once and replay the audio file
+        self.cache_dir = TTS_CACHE_DIR
+        self._audio_cache: dict[str, Path] = {}
+        self._synthesizing: dict[str, asyncio.Future] = {}
+        if self.voice_enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
     
     def _check_voice_capability(self) -> bool:
-        """Check if system can do text-to-speech"""
-        if self.system == "Darwin":  # macOS
-            try:
-                # Just check if say command exists
-                subprocess.run(["which", "say"], capture_output=True, check=True)
-                return True
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                return False
-        return False
-    
-    def make_call(self, phone_number: str, message: str) -> bool:
-        """Simulate making a VoIP call"""
-        print(f"📞 SIMULATED VOIP CALL")
-        print(f"   📱 To: {phone_number}")
-        print(f"   💬 Message: {message}")
-        print(f"   ⏱️  Duration: 3 seconds")
+        """Check if system can do text-to-speech (detected once at import)"""
+        return _VOICE_ENABLED
+    
+    async def make_call(self, phone_number: str, message: str) -> bool:
+        """Simulate making a VoIP call without blocking the event loop"""
+        sys.stdout.write(self._call_banner(phone_number, message))
         
         if self.voice_enabled:
             try:
-                # Use macOS 'say' command for TTS
-                subprocess.run([
-                    "say", 
-                    "-v", "Alex",  # Use Alex voice
-                    "-r", "150",   # Speed
-                    message
-                ], timeout=10)
-                print("   ✅ Voice message played successfully")
-            except subprocess.TimeoutExpired:
-                print("   ⚠️  Voice message timed out")
+                # Play cached audio, synthesizing with macOS 'say' only on a miss
+                await self._play_audio(message)
+                status = self._PLAYED
+            except asyncio.TimeoutError:
+                status = self._TIMED_OUT
             except Exception as e:
-                print(f"   ❌ Voice error: {e}")
+                status = f"{self._VOICE_ERROR}{e}\n"
         else:
-            print("   📢 Text-to-speech not available on this system")
+            status = self._NO_VOICE
         
         # Simulate call duration
-        time.sleep(2)
-        print("   📞 Call ended")
+        if self.sim_duration:
+            await asyncio.sleep(self.sim_duration)
+        sys.stdout.write(status + self._ENDED)
         return True
     
+    async def make_call_templated(self, phone_number: str, *, kind: str = "cardiac", case_id: str) -> bool:
+        """
+        Simulate a call with the standard alert message.
+        Identical (kind, case_id) pairs render the same string, so they share one TTS cache entry.
+        """
+        return await self.make_call(phone_number, _render_alert(kind, case_id))
+    
+    async def make_calls(self, items: list[tuple[str, str]]) -> list[bool]:
+        """
+        Simulate several calls, speaking every message with a single 'say' process.
+        
+        Args:
+            items: (phone_number, message) pairs
+        
+        Returns:
+            One result per call, in order
+        """
+        if not items:
+            return []
+        
+        sys.stdout.write("".join(
+            self._call_banner(phone_number, message)
+            for phone_number, message in items
+        ))
+        
+        if self.voice_enabled:
+            # Pass the joined text as a file so large batches never hit argv limits
+            with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as script:
+                script.write(BATCH_SEPARATOR.join(message for _, message in items))
+            try:
+                await self._speak_batch(script.name, timeout=10 * len(items))
+                status = f"   {_ICONS['ok']} {len(items)} voice messages played successfully\n"
+            except subprocess.TimeoutExpired:
+                status = f"   {_ICONS['warn']} Voice messages timed out\n"
+            except Exception as e:
+                status = f"{self._VOICE_ERROR}{e}\n"
+            finally:
+                os.unlink(script.name)
+        else:
+            status = self._NO_VOICE
+        
+        # Simulate call duration; the batch's calls run side by side
+        if self.sim_duration:
+            await asyncio.sleep(self.sim_duration)
+        sys.stdout.write(f"{status}   {_ICONS['call']} {len(items)} calls ended\n")
+        return [True] * len(items)
+    
+    async def _speak_batch(self, script_path: str, timeout: float):
+        """
+        Speak a text file with one 'say' process.
+        The wait runs on a worker thread blocked on the kernel's exit event, see _wait_process().
+        """
+        process = subprocess.Popen(
+            ["say", "-v", VOICE, "-r", str(RATE), "-f", script_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            returncode = await asyncio.to_thread(_wait_process, process, timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        if returncode != 0:
+            raise OSError(f"say exited with status {returncode}")
+    
+    def _call_banner(self, phone_number: str, message: str) -> str:
+        """Header printed for each simulated call"""
+        return f"{self._BANNER}{self._TO}{phone_number}\n{self._MESSAGE}{message}\n{self._duration_line}"
+    
+    def make_call_sync(self, phone_number: str, message: str) -> bool:
+        """Blocking wrapper around make_call for callers without an event loop"""
+        return asyncio.run(self.make_call(phone_number, message))
+    
+    async def _run_command(self, *args: str, timeout: float = 10):
+        """Run a command in a child process, killing it if it exceeds timeout"""
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        if returncode != 0:
+            raise OSError(f"{args[0]} exited with status {returncode}")
+    
+    async def _play_audio(self, message: str):
+        """Play message from the disk cache, re-synthesizing it if the file has gone"""
+        audio_path = await self._get_audio(message)
+        try:
+            await self._run_command("afplay", str(audio_path))
+        except OSError:
+            if audio_path.exists():
+                raise
+            # Evicted by another simulator or process sharing the cache directory
+            self._audio_cache.pop(self._audio_key(message), None)
+            audio_path = await self._get_audio(message)
+            await self._run_command("afplay", str(audio_path))
+    
+    def _audio_key(self, message: str) -> str:
+        """Disk cache key for message; the voice settings are part of it"""
+        return hashlib.sha256(f"{VOICE}|{RATE}|{message}".encode()).hexdigest()
+    
+    async def _get_audio(self, message: str) -> Path:
+        """Return the audio file for message, synthesizing it on a cache miss"""
+        key = self._audio_key(message)
+        path = self._audio_cache.get(key)
+        if path is not None:
+            return path
+        
+        # Concurrent calls with the same message share a single synthesis
+        pending = self._synthesizing.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._synthesize(key, message))
+            self._synthesizing[key] = pending
+            pending.add_done_callback(lambda _: self._synthesizing.pop(key, None))
+        return await pending
+    
+    async def _synthesize(self, key: str, message: str) -> Path:
+        """Write message to the disk cache with 'say' unless it is already there"""
+        path = self.cache_dir / f"{key}.aiff"
+        if not path.exists():
+            # Write to a temp name first so a timed out synthesis never leaves a truncated file
+            partial = self.cache_dir / f"{key}.partial.aiff"
+            await self._run_command(
+                "say",
+                "-v", VOICE,
+                "-r", str(RATE),
+                "-o", str(partial),
+                message
+            )
+            os.replace(partial, path)
+            self._evict_audio_cache()
+        
+        self._audio_cache[key] = path
+        return path
+    
+    def _evict_audio_cache(self):
+        """Drop the least recently used audio files beyond TTS_CACHE_MAX_FILES"""
+        files = list(self.cache_dir.glob("*.aiff"))
+        if len(files) <= TTS_CACHE_MAX_FILES:
+            return
+        
+        files.sort(key=lambda f: f.stat().st_atime, reverse=True)
+        for stale in files[TTS_CACHE_MAX_FILES:]:
+            stale.unlink(missing_ok=True)
+            self._audio_cache.pop(stale.stem, None)
+    
     def test_connection(self) -> bool:
         """Test VoIP simulator"""
-        print("🔧 Testing VoIP Simulator...")
-        print(f"   System: {self.system}")
-        print(f"   Voice enabled: {self.voice_enabled}")
+        sys.stdout.write(
+            f"{self._TEST_HEADER}"
+            f"   System: {self.system}\n"
+            f"   Voice enabled: {self.voice_enabled}\n"
+        )
         return True
 
-def main():
+async def run_demo(fast: bool = False, repeat: int = 1):
     """Test the VoIP simulator"""
-    print("🏥 ML VoIP Alert System - VoIP Simulator")
-    print("=" * 50)
+    sys.stdout.write(f"{_ICONS['app']} ML VoIP Alert System - VoIP Simulator\n" + "=" * 50 + "\n")
     
-    simulator = VoIPSimulator()
+    # --fast skips TTS and the simulated duration, for CI smoke tests
+    simulator = VoIPSimulator(voice=False, duration=0) if fast else VoIPSimulator()
     
     # Test connection
     simulator.test_connection()
     
     # Test call
-    print("\n📞 Testing simulated call...")
-    simulator.make_call(
-        phone_number="555-123-4567",
-        message="High-risk cardiac score for case ABC123. Check your secure portal."
-    )
+    sys.stdout.write(f"\n{_ICONS['call']} Testing simulated call...\n")
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await simulator.make_call(
+            phone_number="555-123-4567",
+            message="High-risk cardiac score for case ABC123. Check your secure portal."
+        )
+    if repeat > 1:
+        elapsed = time.perf_counter() - started
+        sys.stdout.write(f"   {repeat} calls in {elapsed:.3f}s ({repeat / max(elapsed, 1e-9):.1f} calls/s)\n")
+    
+    # Concurrent calls overlap their TTS and simulated duration
+    sys.stdout.write(f"\n{_ICONS['call']} Testing concurrent simulated calls...\n")
+    await asyncio.gather(*[
+        simulator.make_call_templated("555-123-4567", kind="cardiac", case_id=case_id)
+        for case_id in ("DEF456", "GHI789")
+    ])
+    
+    # Batched calls share one TTS process
+    sys.stdout.write(f"\n{_ICONS['call']} Testing batched simulated calls...\n")
+    await simulator.make_calls([
+        ("555-123-4567", "High-risk cardiac score for case JKL012. Check your secure portal."),
+        ("555-987-6543", "High-risk cardiac score for case MNO345. Check your secure portal.")
+    ])
+    
+    sys.stdout.write(f"\n{_ICONS['ok']} VoIP Simulator test completed!\n")
+
+def main():
+    """Run the VoIP simulator demo"""
+    parser = argparse.ArgumentParser(description="VoIP simulator self-test")
+    parser.add_argument("--fast", action="store_true", help="skip TTS and the simulated call duration")
+    parser.add_argument("--repeat", type=int, default=1, help="repeat the single test call N times (warms the TTS cache)")
+    args = parser.parse_args()
     
-    print("\n✅ VoIP Simulator test completed!")
+    asyncio.run(run_demo(fast=args.fast, repeat=max(1, args.repeat)))
 
 if __name__ == "__main__":
     main()